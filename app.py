@@ -6,9 +6,10 @@ AI Due-Diligence System for Karnataka Land Records
 
 import os
 import sys
-import json
 import time
+import orjson
 import logging
+import threading
 import streamlit as st
 from pathlib import Path
 from dotenv import load_dotenv
@@ -18,8 +19,8 @@ load_dotenv()
 sys.path.insert(0, str(Path(__file__).parent))
 
 # ── Module Imports ─────────────────────────────────────────────────────────────
-from modules.document_extractor_new import extract_document_data 
-from modules.validator import run_all_validations
+from modules.document_extractor_new import extract_documents_batch
+from modules.validator import run_all_validations, USER_UPLOADS_DIR
 from modules.risk_scorer import calculate_risk_score, get_risk_color
 from modules.rag_engine import generate_advisory_report
 from modules.legal_indexer import LegalIndexer
@@ -73,7 +74,8 @@ def init_session_state():
         "ec_data": None,
         "khata_data": None,
         "sale_deed_data": None,
-        "advisory_report": None
+        "advisory_report": None,
+        "validation_error": None
     }
     for key, val in defaults.items():
         if key not in st.session_state:
@@ -85,6 +87,66 @@ init_session_state()
 def get_indexer():
     return LegalIndexer()
 
+# ── Gemini Rate Limiting ──────────────────────────────────────────────────────
+class TokenBucket:
+    """Thread-safe token bucket: blocks only once the per-minute budget is spent."""
+
+    def __init__(self, rate_per_min: float, burst: int):
+        if rate_per_min <= 0 or burst < 1:
+            raise ValueError(f"TokenBucket needs a positive rate and burst, got {rate_per_min}/min, burst {burst}")
+        self.rate = rate_per_min / 60.0
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self.blocked_until:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.blocked_until - now
+            time.sleep(wait)
+
+    def penalize(self, seconds: float):
+        """Empties the bucket and holds it closed, e.g. after a real 429."""
+        with self._lock:
+            self.tokens = 0.0
+            self.blocked_until = self.updated = time.monotonic() + seconds
+
+@st.cache_resource
+def get_rate_limiter():
+    rpm = os.getenv("GEMINI_RPM", "10")
+    try:
+        rate = float(rpm)
+    except ValueError:
+        rate = 0.0
+    if not rate > 0:  # also catches nan
+        logger.warning("Ignoring GEMINI_RPM=%r (must be a positive number); using 10", rpm)
+        rate = 10.0
+    return TokenBucket(rate_per_min=rate, burst=3)
+
+def extract_with_backoff(files, retries=3, penalty=60):
+    """Runs the batch extraction, waiting only when the Gemini budget is actually spent."""
+    bucket = get_rate_limiter()
+    for attempt in range(retries + 1):
+        bucket.acquire()
+        try:
+            return extract_documents_batch(files)
+        except Exception as e:
+            if "429" not in str(e) or attempt == retries:
+                raise
+            logger.warning("Quota hit on %s, closing the rate gate for %ds", list(files), penalty)
+            bucket.penalize(penalty)
+
 # ── Sidebar ───────────────────────────────────────────────────────────────────
 with st.sidebar:
     st.markdown("### ⚖️ LegalDoc AI")
@@ -140,44 +202,35 @@ if st.button("🔍 Perform Full Verification", type="primary", disabled=not all_
     progress_bar = st.progress(0)
     
     # Critical: Ensure target directory exists for validator
-    upload_dir = Path("user_uploads")
+    upload_dir = USER_UPLOADS_DIR
     upload_dir.mkdir(exist_ok=True)
     
     try:
-        # Sequential Extraction with Session State "Checkpoints"
-        
-        # 1. EC Extraction
-        if st.session_state.ec_data is None:
-            status.info("Extracting EC... (Stage 1/3)")
-            data = extract_document_data(ec_file, "ec")
-            st.session_state.ec_data = data
-            # Sync to local disk for run_all_validations
-            with open(upload_dir / "user_ec.json", "w") as f:
-                json.dump(data, f, indent=4)
-            status.success("✓ EC Cached. Cooling down API for 12s...")
-            time.sleep(12) 
-        progress_bar.progress(30)
-
-        # 2. Khata Extraction
-        if st.session_state.khata_data is None:
-            status.info("Extracting Khata... (Stage 2/3)")
-            data = extract_document_data(khata_file, "khata")
-            st.session_state.khata_data = data
-            # Sync to local disk
-            with open(upload_dir / "user_khata.json", "w") as f:
-                json.dump(data, f, indent=4)
-            status.success("✓ Khata Cached. Cooling down...")
-            time.sleep(12)
-        progress_bar.progress(60)
-
-        # 3. Sale Deed Extraction
-        if st.session_state.sale_deed_data is None:
-            status.info("Extracting Sale Deed... (Stage 3/3)")
-            data = extract_document_data(sale_deed_file, "sale_deed")
-            st.session_state.sale_deed_data = data
-            # Sync to local disk
-            with open(upload_dir / "user_sale_deed.json", "w") as f:
-                json.dump(data, f, indent=4)
+        # Batched Extraction with Session State "Checkpoints"
+        pending = [
+            (f, doc_type, key, disk_name)
+            for f, doc_type, key, disk_name in [
+                (ec_file, "ec", "ec_data", "user_ec.json"),
+                (khata_file, "khata", "khata_data", "user_khata.json"),
+                (sale_deed_file, "sale_deed", "sale_deed_data", "user_sale_deed.json"),
+            ]
+            if st.session_state[key] is None
+        ]
+
+        if pending:
+            status.info(f"Extracting {len(pending)} document(s) in one batch...")
+            extracted = extract_with_backoff({doc_type: f for f, doc_type, _, _ in pending})
+            for f, doc_type, key, disk_name in pending:
+                if doc_type not in extracted:
+                    continue
+                data = extracted[doc_type]
+                st.session_state[key] = data
+                # Sync to local disk for run_all_validations
+                (upload_dir / disk_name).write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+            # Checkpoint what came back first, so a retry only re-extracts the rest
+            missing = [doc_type for _, doc_type, _, _ in pending if doc_type not in extracted]
+            if missing:
+                raise ValueError(f"No data returned for {', '.join(missing)}. Click 'Run' again to retry them.")
             status.success("✓ All documents extracted.")
         progress_bar.progress(85)
 
@@ -188,6 +241,7 @@ if st.button("🔍 Perform Full Verification", type="primary", disabled=not all_
         
         # Save to session state for the UI display below
         st.session_state.validation_results = validation_output.get("rule_checks", [])
+        st.session_state.validation_error = validation_output.get("error")
         
         # Stage 2: Agentic RAG (Only if structural failures exist)
         failures = [f for f in st.session_state.validation_results if not f.get('passed')]
@@ -232,6 +286,8 @@ if st.session_state.processing_done:
 
     # A. Display Structural Integrity results (The PASS/FAIL boxes)
     st.markdown("### 🔍 Structural Integrity Results")
+    if st.session_state.validation_error:
+        st.error(f"Validation could not read the extracted data: {st.session_state.validation_error}")
     v_results = st.session_state.get("validation_results", [])
     if v_results:
         cols = st.columns(len(v_results))
@@ -265,6 +321,6 @@ if st.session_state.processing_done:
     # Reset Button
     if st.button("Clear Results & Restart"):
         for key in ["ec_data", "khata_data", "sale_deed_data", "advisory_report", 
-                    "processing_done", "validation_results", "risk_data"]:
+                    "processing_done", "validation_results", "risk_data", "validation_error"]:
             st.session_state[key] = None if key != "processing_done" else False
         st.rerun()
\ No newline at end of file
@@ -13,7 +13,7 @@ echo Step 3: Installing latest transformers stack...
 pip install transformers tokenizers huggingface-hub
 
 echo Step 4: Installing project packages...
-pip install streamlit faiss-cpu pdfplumber PyPDF2 anthropic openai python-dotenv numpy pandas
+pip install streamlit faiss-cpu pdfplumber PyPDF2 anthropic openai python-dotenv numpy pandas onnxruntime optimum[onnxruntime]
 
 echo Step 5: Verifying...
 python -c "import torch; print('torch', torch.__version__)"
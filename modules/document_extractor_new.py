@@ -1,11 +1,14 @@
+import io
 import os
 import json
-import time
 import logging
 from pathlib import Path
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
+from pydantic import BaseModel
 
 # ── Environment & Path Setup ──────────────────────────────────────────────────
 # Automatically find and load the .env file
@@ -26,68 +29,180 @@ if not API_KEY:
 client = genai.Client(api_key=API_KEY)
 MODEL_ID = "gemini-2.5-flash"  # As requested
 
+# ── Response Schemas ──────────────────────────────────────────────────────────
+# Constrained decoding targets: the fields read by validator / rag_engine.
+# Gemini rejects non-None defaults in response schemas, so everything is Optional.
+
+class ECTransaction(BaseModel):
+    date: Optional[str] = None
+    document_number: Optional[str] = None
+    nature: Optional[str] = None
+    executant: Optional[str] = None
+    claimant: Optional[str] = None
+
+class ECSchema(BaseModel):
+    survey_number: Optional[str] = None
+    village: Optional[str] = None
+    taluk: Optional[str] = None
+    district: Optional[str] = None
+    mortgage_status: Optional[str] = None
+    transactions: Optional[List[ECTransaction]] = None
+
+class KhataSchema(BaseModel):
+    khata_number: Optional[str] = None
+    owner_name: Optional[str] = None
+    survey_number: Optional[str] = None
+    village: Optional[str] = None
+    taluk: Optional[str] = None
+    district: Optional[str] = None
+    area: Optional[str] = None
+
+class SaleDeedSchema(BaseModel):
+    seller_name: Optional[str] = None
+    purchaser_name: Optional[str] = None
+    survey_number: Optional[str] = None
+    execution_date: Optional[str] = None
+    registration_number: Optional[str] = None
+    sale_consideration: Optional[str] = None
+    village: Optional[str] = None
+    district: Optional[str] = None
+
+class BatchSchema(BaseModel):
+    ec: Optional[ECSchema] = None
+    khata: Optional[KhataSchema] = None
+    sale_deed: Optional[SaleDeedSchema] = None
+
+SCHEMAS = {"ec": ECSchema, "khata": KhataSchema, "sale_deed": SaleDeedSchema}
+
+# ── Prompts ───────────────────────────────────────────────────────────────────
+# doc_type is a closed set, so every prompt is built once at import time
+
+_EXTRACTOR_ROLE = "You are a professional legal document extractor for Karnataka Land Records. "
+
+SYSTEM_INSTRUCTIONS = {
+    doc_type: _EXTRACTOR_ROLE + f"Extract all relevant information from the provided {doc_type} document."
+    for doc_type in SCHEMAS
+}
+EXTRACTION_PROMPTS = {
+    doc_type: f"Extract data from this {doc_type} into a clear JSON structure."
+    for doc_type in SCHEMAS
+}
+BATCH_SYSTEM_INSTRUCTION = _EXTRACTOR_ROLE + "Extract all relevant information from every provided document."
+
+def _parsed(response, label) -> dict:
+    """Returns the schema-parsed response as a plain dict (absent fields dropped)."""
+    if response.parsed is None:
+        raise ValueError(f"Gemini returned no output matching the {label} schema.")
+    return response.parsed.model_dump(exclude_none=True)
+
 # ── Extraction Logic ──────────────────────────────────────────────────────────
 
+def _upload_pdf(pdf_file, doc_type: str):
+    """Uploads a Streamlit UploadedFile or local path to the Gemini File API."""
+    # Files are stored in Gemini Cloud Storage for 48 hours
+    logger.info(f"Uploading {doc_type} to Google File API...")
+
+    # Check if the input is a Streamlit UploadedFile object or a local path
+    if hasattr(pdf_file, 'getvalue'):
+        # Hand the in-memory bytes straight to the SDK (no temp-file round-trip)
+        buf = io.BytesIO(pdf_file.getvalue())
+        buf.name = f"{doc_type}.pdf"
+        return client.files.upload(
+            file=buf, config=types.UploadFileConfig(mime_type="application/pdf")
+        )
+    # If it's a string path, upload it directly
+    return client.files.upload(file=str(pdf_file))
+
 def extract_document_data(pdf_file, doc_type: str) -> dict:
     """
     Extracts structured data from a PDF file using the Gemini File API.
     Handles scanned documents natively using multimodal vision.
     """
-    
-    # Save a temporary file for the Google File API
-    temp_path = BASE_DIR / f"temp_{int(time.time())}_{doc_type}.pdf"
-    
-    # Check if the input is a Streamlit UploadedFile object or a local path
-    if hasattr(pdf_file, 'getvalue'):
-        with open(temp_path, "wb") as f:
-            f.write(pdf_file.getvalue())
-    else:
-        # If it's a string path, copy it
-        with open(pdf_file, "rb") as src, open(temp_path, "wb") as dst:
-            dst.write(src.read())
-
     try:
-        # 1. Upload to Gemini Cloud Storage (Files are stored for 48 hours)
-        logger.info(f"Uploading {doc_type} to Google File API...")
-        uploaded_file = client.files.upload(file=str(temp_path))
+        # 1. Upload to Gemini Cloud Storage
+        uploaded_file = _upload_pdf(pdf_file, doc_type)
         
-        # 2. Define the System Prompt
-        # This tells the model how to act and what format to return
-        system_instruction = (
-            f"You are a professional legal document extractor for Karnataka Land Records. "
-            f"Extract all relevant information from the provided {doc_type} document."
-        )
+        # 2. The System Prompt tells the model how to act (precomputed per doc_type)
+        system_instruction = SYSTEM_INSTRUCTIONS[doc_type]
 
-        # 3. Perform Generation with Structured Output (JSON Mode)
+        # 3. Perform Generation with Structured Output (Schema-constrained)
         logger.info(f"Generating content for {doc_type} using {MODEL_ID}...")
         response = client.models.generate_content(
             model=MODEL_ID,
-            contents=[uploaded_file, f"Extract data from this {doc_type} into a clear JSON structure."],
+            contents=[uploaded_file, EXTRACTION_PROMPTS[doc_type]],
             config=types.GenerateContentConfig(
                 system_instruction=system_instruction,
-                response_mime_type="application/json", # Forces valid JSON output
+                response_mime_type="application/json",
+                response_schema=SCHEMAS[doc_type], # Constrains output to the known fields
                 temperature=0.1,  # Lower temperature for higher accuracy
             )
         )
 
-        # 4. Parse and return JSON data
-        return json.loads(response.text)
+        # 4. Return the SDK-parsed data
+        return _parsed(response, doc_type)
 
     except Exception as e:
         logger.error(f"Extraction failed for {doc_type}: {str(e)}")
         raise e
 
-    finally:
-        # 5. Local Cleanup of the temporary file
-        if temp_path.exists():
-            os.remove(temp_path)
+def extract_documents_batch(files: Dict[str, object]) -> Dict[str, dict]:
+    """
+    Extracts several documents with a single Gemini call.
+    `files` maps doc_type ("ec", "khata", "sale_deed") to an UploadedFile or path;
+    the result maps each doc_type to its extracted JSON. A doc_type the model left
+    out entirely is absent from the result, so callers can keep the rest and retry it.
+    """
+    if not files:
+        return {}
+    doc_types = list(files)
+
+    try:
+        # 1. Upload all PDFs concurrently (client.files.upload is blocking I/O)
+        with ThreadPoolExecutor(max_workers=len(doc_types)) as executor:
+            uploaded = list(executor.map(lambda dt: _upload_pdf(files[dt], dt), doc_types))
+
+        # 2. Interleave each file with its label so the model can key the output
+        contents = []
+        for doc_type, uploaded_file in zip(doc_types, uploaded):
+            contents += [f"=== {doc_type.upper()} ===", uploaded_file]
+        contents.append(
+            f"Extract data from each labelled document above into a clear JSON structure. "
+            f"Return ONE JSON object whose top-level keys are exactly {doc_types}, "
+            f"each holding the data of the document with that label."
+        )
+
+        # 3. One prefill, one round-trip for every document
+        logger.info(f"Generating content for {doc_types} using {MODEL_ID}...")
+        response = client.models.generate_content(
+            model=MODEL_ID,
+            contents=contents,
+            config=types.GenerateContentConfig(
+                system_instruction=BATCH_SYSTEM_INSTRUCTION,
+                response_mime_type="application/json",
+                response_schema=BatchSchema,
+                temperature=0.1,
+            )
+        )
+
+        data = _parsed(response, "batch")
+        # Omitted documents are dropped rather than saved as {} (never re-extracted).
+        # A document returned with every field null dumps to {} too, but it did come
+        # back: it is kept and simply fails validation.
+        returned = [doc_type for doc_type in doc_types if getattr(response.parsed, doc_type) is not None]
+        if len(returned) < len(doc_types):
+            logger.warning(f"Batch response omitted {sorted(set(doc_types) - set(returned))}")
+        return {doc_type: data.get(doc_type, {}) for doc_type in returned}
+
+    except Exception as e:
+        logger.error(f"Batch extraction failed for {doc_types}: {str(e)}")
+        raise e
 
 # Example Usage
 if __name__ == "__main__":
     # Test path - replace with your actual sample path
     test_pdf = BASE_DIR / "knowledge_base" / "templates" / "ec" / "EC_sample.pdf"
     if test_pdf.exists():
-        data = extract_document_data(test_pdf, "Encumbrance Certificate")
+        data = extract_document_data(test_pdf, "ec")
         print(json.dumps(data, indent=2))
     else:
         print(f"Sample file not found at {test_pdf}")
\ No newline at end of file
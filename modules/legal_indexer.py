@@ -3,105 +3,228 @@ legal_indexer.py
 ────────────────
 FAISS vector store for legal act documents.
 
-Embeddings: uses transformers + torch directly.
+Embeddings: ONNX Runtime (CPUExecutionProvider) with dynamic int8 weights.
 NO sentence-transformers dependency — eliminates all version conflict errors
-on Windows Python 3.10.
+on Windows Python 3.10. torch is only needed for the one-off ONNX export.
 
-Model: BAAI/bge-small-en-v1.5  (384-dim, ~130MB, cached after first run)
+Model: BAAI/bge-small-en-v1.5  (384-dim, quantized ONNX cached after first run)
 """
 
 import os
 import pickle
+import functools
 import logging
+import msgpack
 import numpy as np
 from typing import List, Dict, Optional
+from modules.llm_cache import cached_embedding
 
 logger = logging.getLogger(__name__)
 
 VECTOR_STORE_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "vector_store")
 FAISS_INDEX_PATH = os.path.join(VECTOR_STORE_DIR, "legal_index.faiss")
-METADATA_PATH    = os.path.join(VECTOR_STORE_DIR, "legal_metadata.pkl")
+METADATA_PATH    = os.path.join(VECTOR_STORE_DIR, "legal_metadata.msgpack")
+LEGACY_METADATA_PATH = os.path.join(VECTOR_STORE_DIR, "legal_metadata.pkl")
+ONNX_MODEL_DIR   = os.path.join(VECTOR_STORE_DIR, "..", "onnx_model")
 os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
 
 
+# ── Mean-pooling + L2 normalisation (Numba-fused when available) ──────────────
+try:
+    from numba import njit, prange
+
+    # Signature pinned so compilation happens at import, not on the first query
+    @njit("float32[:, :](float32[:, :, :], int64[:, :])",
+          parallel=True, fastmath=True, cache=True)
+    def _mean_pool_normalize(hidden, mask):
+        n, seq, dim = hidden.shape
+        out = np.zeros((n, dim), dtype=np.float32)
+        for b in prange(n):
+            count = 0
+            for t in range(seq):
+                if mask[b, t]:
+                    count += 1
+                    for d in range(dim):
+                        out[b, d] += hidden[b, t, d]
+            sq = 0.0
+            for d in range(dim):
+                out[b, d] /= max(count, 1)
+                sq += out[b, d] * out[b, d]
+            norm = max(np.sqrt(sq), 1e-12)
+            for d in range(dim):
+                out[b, d] /= norm
+        return out
+
+except ImportError:
+    def _mean_pool_normalize(hidden, mask):
+        m = mask[..., None].astype(np.float32)
+        emb = (hidden * m).sum(1) / np.clip(m.sum(1), 1e-9, None)
+        return emb / np.clip(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12, None)
+
+
 class EmbeddingModel:
     """
-    Local embeddings via HuggingFace transformers directly.
+    Local embeddings via ONNX Runtime.
     Mean-pooling + L2 normalisation over BAAI/bge-small-en-v1.5.
     """
     MODEL_NAME = "BAAI/bge-small-en-v1.5"
     DIMENSION  = 384
+    ONNX_FILE  = "model_quantized.onnx"
+    QUERY_CACHE_SIZE = 512
 
     def __init__(self):
         self.dimension = self.DIMENSION
-        self._load()
+        # Queries come from a small fixed rule set, so repeats skip the forward pass
+        self._embed_cached = functools.lru_cache(maxsize=self.QUERY_CACHE_SIZE)(self._embed_query)
+        # Loaded on first embed: keeps tokenizer/ONNX imports off the app's cold start
+        self._session = None
 
     def _load(self):
         try:
-            from transformers import AutoTokenizer, AutoModel
-            import torch
-            self._tok   = AutoTokenizer.from_pretrained(self.MODEL_NAME)
-            self._model = AutoModel.from_pretrained(self.MODEL_NAME)
-            self._model.eval()
-            self._torch = torch
-            logger.info("Embedding model loaded: %s", self.MODEL_NAME)
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+            onnx_path = os.path.join(ONNX_MODEL_DIR, self.ONNX_FILE)
+            if not os.path.exists(onnx_path):
+                self._export_quantized()
+            self._tok     = AutoTokenizer.from_pretrained(ONNX_MODEL_DIR)
+            self._session = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+            self._inputs  = {i.name for i in self._session.get_inputs()}
+            logger.info("Embedding model loaded: %s (ONNX int8)", self.MODEL_NAME)
         except Exception as e:
             raise RuntimeError(
                 f"Could not load embedding model. "
-                f"Run: pip install transformers torch\nError: {e}"
+                f"Run: pip install onnxruntime optimum[onnxruntime] transformers\nError: {e}"
             )
 
+    def _export_quantized(self):
+        """One-off export of the HF model to ONNX with dynamic int8 weights."""
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+        logger.info("Exporting %s to quantized ONNX (first run only)...", self.MODEL_NAME)
+        model = ORTModelForFeatureExtraction.from_pretrained(self.MODEL_NAME, export=True)
+        quantizer = ORTQuantizer.from_pretrained(model)
+        quantizer.quantize(
+            save_dir=ONNX_MODEL_DIR,
+            quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False),
+        )
+        AutoTokenizer.from_pretrained(self.MODEL_NAME).save_pretrained(ONNX_MODEL_DIR)
+
     def _pool(self, hidden, mask):
-        m = mask.unsqueeze(-1).expand(hidden.size()).float()
-        return (hidden * m).sum(1) / m.sum(1).clamp(min=1e-9)
+        return _mean_pool_normalize(np.asarray(hidden, dtype=np.float32),
+                                    np.asarray(mask, dtype=np.int64))
+
+    def _ensure_loaded(self):
+        if self._session is None:
+            self._load()
+
+    def _run(self, enc) -> np.ndarray:
+        feed = {k: v.astype(np.int64) for k, v in enc.items() if k in self._inputs}
+        h    = self._session.run(None, feed)[0]
+        return self._pool(h, enc["attention_mask"])
 
     def embed(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
         if not texts:
             return np.array([], dtype=np.float32)
-        torch = self._torch
-        out   = []
+        self._ensure_loaded()
+        out = []
         for i in range(0, len(texts), batch_size):
             batch = texts[i:i+batch_size]
-            enc   = self._tok(batch, padding=True, truncation=True,
-                              max_length=512, return_tensors="pt")
-            with torch.no_grad():
-                h = self._model(**enc).last_hidden_state
-            emb = self._pool(h, enc["attention_mask"])
-            emb = torch.nn.functional.normalize(emb, p=2, dim=1)
-            out.append(emb.numpy().astype(np.float32))
+            # Pad to the longest text in the batch, never to max_length
+            enc   = self._tok(batch, padding="longest", truncation=True,
+                              max_length=512, return_tensors="np")
+            out.append(self._run(enc))
         return np.vstack(out)
 
+    def _embed_query(self, text: str) -> np.ndarray:
+        # Persisted across restarts; the lru_cache in front absorbs hot repeats
+        return cached_embedding(self.MODEL_NAME, text, self._encode_query)
+
+    def _encode_query(self, text: str) -> np.ndarray:
+        self._ensure_loaded()
+        # Single query: no padding, attention only spans the real tokens
+        enc = self._tok([text], padding=False, truncation=True,
+                        max_length=512, return_tensors="np")
+        return self._run(enc)[0]
+
     def embed_single(self, text: str) -> np.ndarray:
-        return self.embed([text])[0]
+        # Copy so callers can't mutate the cached vector
+        return self._embed_cached(text).copy()
 
 
 class LegalIndexer:
     """FAISS vector store. Fully local — no API key needed."""
+    HNSW_M          = 32
+    EF_CONSTRUCTION = 200
+    EF_SEARCH       = 64
 
     def __init__(self, embedding_provider: str = "huggingface"):
         self.embedder = EmbeddingModel()
         self.index    = None
         self.metadata: List[Dict] = []
+        self._mmapped = False
+        self._acts_cache: Optional[set] = None
         self._load_or_init()
+        self._set_faiss_threads()
+
+    def _set_faiss_threads(self):
+        """Streamlit is rarely started with OMP_NUM_THREADS; give FAISS all but one core."""
+        import faiss
+        if not os.getenv("OMP_NUM_THREADS"):
+            faiss.omp_set_num_threads(max(1, (os.cpu_count() or 1) - 1))
 
     def _load_or_init(self):
-        if os.path.exists(FAISS_INDEX_PATH) and os.path.exists(METADATA_PATH):
+        has_metadata = os.path.exists(METADATA_PATH) or os.path.exists(LEGACY_METADATA_PATH)
+        if os.path.exists(FAISS_INDEX_PATH) and has_metadata:
             self._load_index()
         else:
             self._new_index()
 
     def _new_index(self):
         import faiss
-        self.index    = faiss.IndexFlatIP(self.embedder.dimension)
+        # Vectors are L2-normalised, so inner product == cosine similarity;
+        # fp16 storage halves the bytes read per distance with no visible recall loss
+        self.index = faiss.IndexHNSWSQ(self.embedder.dimension, faiss.ScalarQuantizer.QT_fp16,
+                                       self.HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        self.index.hnsw.efConstruction = self.EF_CONSTRUCTION
         self.metadata = []
+        self._mmapped = False
+        self._acts_cache = set()
 
     def _load_index(self):
         import faiss
-        self.index = faiss.read_index(FAISS_INDEX_PATH)
+        # IO_FLAG_MMAP only maps IVF inverted lists; for HNSW/flat codes it still
+        # copies everything into RAM. faiss >= 1.10 can map the codes themselves,
+        # so the OS page cache serves hot vectors and cold pages fault in.
+        mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+        if mmap_flag is not None:
+            self.index = faiss.read_index(FAISS_INDEX_PATH, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+        else:
+            self.index = faiss.read_index(FAISS_INDEX_PATH)
+        self._mmapped = mmap_flag is not None
+        if not os.path.exists(METADATA_PATH):
+            self._migrate_legacy_metadata()
         with open(METADATA_PATH, "rb") as f:
-            self.metadata = pickle.load(f)
+            self.metadata = msgpack.unpackb(f.read(), raw=False)
+        self._acts_cache = None
         logger.info("Loaded index: %d vectors", self.index.ntotal)
 
+    def _migrate_legacy_metadata(self):
+        """One-off conversion of the old pickle metadata store to msgpack."""
+        with open(LEGACY_METADATA_PATH, "rb") as f:
+            metadata = pickle.load(f)
+        with open(METADATA_PATH, "wb") as f:
+            f.write(msgpack.packb(metadata, use_bin_type=True))
+        os.remove(LEGACY_METADATA_PATH)
+        logger.info("Migrated metadata store to %s", METADATA_PATH)
+
+    def _ensure_writable(self):
+        """Swaps a memory-mapped index for an in-RAM copy before mutating it."""
+        if self._mmapped:
+            import faiss
+            self.index = faiss.read_index(FAISS_INDEX_PATH)
+            self._mmapped = False
+
     def add_chunks(self, chunks: List[Dict]) -> int:
         if not chunks:
             return 0
@@ -110,13 +233,18 @@ class LegalIndexer:
             return 0
         if emb.ndim == 1:
             emb = emb.reshape(1, -1)
+        self._ensure_writable()
+        if not self.index.is_trained:  # fp16 SQ has no real parameters to learn
+            self.index.train(emb)
         self.index.add(emb)
         self.metadata.extend(chunks)
+        if self._acts_cache is not None:
+            self._acts_cache.update(c.get("act_name", "Unknown") for c in chunks)
         return len(chunks)
 
     def clear_index(self):
         self._new_index()
-        for p in [FAISS_INDEX_PATH, METADATA_PATH]:
+        for p in [FAISS_INDEX_PATH, METADATA_PATH, LEGACY_METADATA_PATH]:
             if os.path.exists(p):
                 os.remove(p)
 
@@ -124,10 +252,35 @@ class LegalIndexer:
         if not self.index or self.index.ntotal == 0:
             return []
         q = self.embedder.embed_single(query).reshape(1, -1)
+        scores, idxs = self._search_vectors(q, k)
+        return self._collect(scores[0], idxs[0])
+
+    def search_batch(self, queries: List[str], k: int = 5) -> List[List[Dict]]:
+        """Embeds all queries in one forward pass and runs one FAISS search."""
+        if not queries:
+            return []
+        if not self.index or self.index.ntotal == 0:
+            return [[] for _ in queries]
+        return self.search_by_vectors(self.embedder.embed(queries), k)
+
+    def search_by_vectors(self, vectors: np.ndarray, k: int = 5) -> List[List[Dict]]:
+        """Searches with already-computed query embeddings (one FAISS call)."""
+        if len(vectors) == 0:
+            return []
+        if not self.index or self.index.ntotal == 0:
+            return [[] for _ in range(len(vectors))]
+        scores, idxs = self._search_vectors(np.asarray(vectors, dtype=np.float32), k)
+        return [self._collect(s, i) for s, i in zip(scores, idxs)]
+
+    def _search_vectors(self, q: np.ndarray, k: int):
         k = min(k, self.index.ntotal)
-        scores, idxs = self.index.search(q, k)
+        if hasattr(self.index, "hnsw"):  # older stores may still be flat
+            self.index.hnsw.efSearch = max(self.EF_SEARCH, k * 4)
+        return self.index.search(q, k)
+
+    def _collect(self, scores, idxs) -> List[Dict]:
         results = []
-        for s, i in zip(scores[0], idxs[0]):
+        for s, i in zip(scores, idxs):
             if i == -1:
                 continue
             c = dict(self.metadata[i])
@@ -136,10 +289,19 @@ class LegalIndexer:
         return results
 
     def save_index(self):
+        """Writes both files to .tmp siblings, then renames them into place."""
         import faiss
-        faiss.write_index(self.index, FAISS_INDEX_PATH)
-        with open(METADATA_PATH, "wb") as f:
-            pickle.dump(self.metadata, f)
+        index_tmp, meta_tmp = FAISS_INDEX_PATH + ".tmp", METADATA_PATH + ".tmp"
+        faiss.write_index(self.index, index_tmp)
+        with open(index_tmp, "rb+") as f:
+            os.fsync(f.fileno())
+        with open(meta_tmp, "wb") as f:
+            f.write(msgpack.packb(self.metadata, use_bin_type=True))
+            f.flush()
+            os.fsync(f.fileno())
+        # A crash before here leaves the previous store untouched
+        os.replace(index_tmp, FAISS_INDEX_PATH)
+        os.replace(meta_tmp, METADATA_PATH)
 
     @property
     def vector_count(self) -> int:
@@ -147,7 +309,10 @@ class LegalIndexer:
 
     @property
     def indexed_acts(self) -> List[str]:
-        return sorted({m.get("act_name", "Unknown") for m in self.metadata})
+        # Recomputed only after a load; add_chunks/clear_index keep it current
+        if self._acts_cache is None:
+            self._acts_cache = {m.get("act_name", "Unknown") for m in self.metadata}
+        return sorted(self._acts_cache)
 
     def get_stats(self) -> Dict:
         return {
@@ -0,0 +1,96 @@
+"""
+llm_cache.py
+────────────
+Restart-safe cache for Gemini outputs and query embeddings.
+
+Backed by LMDB (memory-mapped, so hits are plain page-cache reads) and keyed
+by sha256 of the input. If `lmdb` is not installed or the store can't be
+opened the cache is disabled, and a failed read or write (e.g. a full map)
+only skips the cache: every call still reaches the model.
+"""
+
+import os
+import hashlib
+import logging
+import functools
+import numpy as np
+from typing import Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "llm_cache")
+# Upper bound on the store. Nothing is evicted, so writes fail once it is full.
+# On Windows the data file is grown to this size up front, hence kept modest.
+MAP_SIZE      = 256 << 20
+
+
+@functools.lru_cache(maxsize=1)
+def _open() -> Optional[Tuple]:
+    """Opens the environment once; returns (env, generations_db, embeddings_db)."""
+    try:
+        import lmdb
+    except ImportError:
+        logger.info("lmdb not installed; persistent LLM cache disabled")
+        return None
+    try:
+        os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+        env = lmdb.open(LLM_CACHE_DIR, map_size=MAP_SIZE, max_dbs=2)
+        return env, env.open_db(b"generations"), env.open_db(b"embeddings")
+    except (OSError, lmdb.Error) as e:
+        logger.warning("Could not open LLM cache at %s (%s); cache disabled", LLM_CACHE_DIR, e)
+        return None
+
+
+def _key(namespace: str, text: str) -> bytes:
+    return hashlib.sha256(f"{namespace}\0{text}".encode("utf-8")).digest()
+
+
+def _get(db, key: bytes) -> Optional[bytes]:
+    """Cached value, or None on a miss or any store error."""
+    import lmdb
+    try:
+        with _open()[0].begin(db=db) as txn:
+            hit = txn.get(key)
+    except lmdb.Error as e:
+        logger.warning("LLM cache read failed: %s", e)
+        return None
+    return bytes(hit) if hit is not None else None
+
+
+def _put(db, key: bytes, value: bytes):
+    """Best-effort write; a store error (e.g. MapFullError) is logged and dropped."""
+    import lmdb
+    try:
+        with _open()[0].begin(db=db, write=True) as txn:
+            txn.put(key, value)
+    except lmdb.Error as e:
+        logger.warning("LLM cache write failed: %s", e)
+
+
+def cached_generate(model, prompt: str) -> str:
+    """model.generate_content(prompt).text, persisted across restarts."""
+    store = _open()
+    if store is None:
+        return model.generate_content(prompt).text
+    key = _key(model.model_name, prompt)
+    hit = _get(store[1], key)
+    if hit is not None:
+        return hit.decode("utf-8")
+    text = model.generate_content(prompt).text
+    _put(store[1], key, text.encode("utf-8"))
+    return text
+
+
+def cached_embedding(model_name: str, text: str,
+                     compute: Callable[[str], np.ndarray]) -> np.ndarray:
+    """compute(text) as float32, persisted across restarts."""
+    store = _open()
+    if store is None:
+        return compute(text)
+    key = _key(model_name, text)
+    hit = _get(store[2], key)
+    if hit is not None:
+        return np.frombuffer(hit, dtype=np.float32).copy()
+    emb = np.asarray(compute(text), dtype=np.float32)
+    _put(store[2], key, emb.tobytes())
+    return emb
@@ -11,16 +11,24 @@ Synthesizes a legal advisory report by combining:
 
 import os
 import logging
+import functools
 import google.generativeai as genai
 from typing import Dict, List, Optional
+from modules.llm_cache import cached_generate
 
 logger = logging.getLogger(__name__)
 
+@functools.lru_cache(maxsize=1)
+def _model() -> genai.GenerativeModel:
+    """Configures Gemini once and reuses one model handle across calls."""
+    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+    return genai.GenerativeModel('gemini-2.5-flash')
+
 # --- 1. AGENTIC QUERY GENERATION ---
 
 def generate_smart_legal_query(failure_details: str) -> str:
     """Uses Gemini to translate a technical error into a legal research query."""
-    model = genai.GenerativeModel('gemini-2.5-flash')
+    model = _model()
     prompt = f"""
     Transform this property document discrepancy into a formal legal research query 
     for the Karnataka Land Revenue and Registration Acts:
@@ -29,8 +37,7 @@ def generate_smart_legal_query(failure_details: str) -> str:
     Example Output: "Legal validity of sale deeds with survey number mismatches in Karnataka"
     """
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        return cached_generate(model, prompt).strip()
     except Exception as e:
         logger.error(f"Query generation failed: {e}")
         return failure_details # Fallback to raw error
@@ -44,35 +51,46 @@ def generate_advisory_report(ec_data, khata_data, sd_data, validation_results, r
     Synthesizes a legal advisory by batching local retrieval and a single LLM call.
     Resolves 'AttributeError' by safely handling both Dict and Object metadata.
     """
-    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-    model = genai.GenerativeModel('gemini-2.5-flash')
+    model = _model()
     
     # Filter for failed structural checks to drive the research
     failures = [f for f in validation_results if not f.get('passed')]
     
     # --- STAGE 1: LOCAL HYBRID RETRIEVAL (Zero API Cost) ---
-    combined_context = ""
     print("\n" + "="*50)
     print("📋 BATCH PROCESSING: LOCAL LEGAL RETRIEVAL")
     
-    for fail in failures:
-        # Use the specific failure to query your 276 indexed vectors
-        search_term = f"{fail['check_name']} {fail['reason']}"
+    # Use each specific failure to query your 276 indexed vectors
+    search_terms = [f"{fail['check_name']} {fail['reason']}" for fail in failures]
+    for search_term in search_terms:
         print(f"🔍 Searching Knowledge Base for: {search_term}")
-        
-        # Local search doesn't hit Gemini quota
-        hits = indexer.search(search_term, k=2) 
-        
+    
+    # Failures often retrieve the same sections (e.g. Section 17): keep each
+    # (act, section) once, with its best score, to keep the prompt short
+    seen: Dict[tuple, tuple] = {}
+    
+    # Local search doesn't hit Gemini quota; one forward pass covers every failure
+    for hits in indexer.search_batch(search_terms, k=2):
         # SAFE DATA EXTRACTION: Handles 'dict' vs 'LangChain Document'
         for h in hits:
             if isinstance(h, dict):
                 # If hit is a dictionary, use bracket notation
                 content = h.get('text') or h.get('page_content') or str(h)
+                meta = h
             else:
                 # If hit is an object (LangChain), use getattr to prevent crashes
                 content = getattr(h, 'page_content', str(h))
+                meta = getattr(h, 'metadata', None) or {}
             
-            combined_context += content + "\n\n"
+            key = (meta.get('act_name'), meta.get('section_id'))
+            if key == (None, None):
+                key = (content,)  # no section metadata: dedupe on the text itself
+            score = meta.get('score', 0.0)
+            if key not in seen or score > seen[key][0]:
+                seen[key] = (score, content[:800])
+    
+    ranked = sorted(seen.values(), key=lambda v: v[0], reverse=True)
+    combined_context = "\n\n".join(content for _, content in ranked)
     
     print("="*50 + "\n")
 
@@ -102,8 +120,7 @@ def generate_advisory_report(ec_data, khata_data, sd_data, validation_results, r
 
     try:
         # This is the ONLY API call made in this function, staying under RPM limits
-        response = model.generate_content(batch_prompt)
-        return response.text.strip()
+        return cached_generate(model, batch_prompt).strip()
     except Exception as e:
         logger.error(f"RAG Synthesis failed: {e}")
         if "429" in str(e):
@@ -112,23 +129,19 @@ def generate_advisory_report(ec_data, khata_data, sd_data, validation_results, r
 
 def perform_agentic_research(validation_results, indexer):
     """Translates structural failures into legal queries & retrieves context."""
-    model = genai.GenerativeModel('gemini-2.0-flash')
-    
     # Filter for failed checks only
     failures = [f for f in validation_results if not f.get('passed')]
     if not failures:
         return "No structural discrepancies found; legal research skipped."
 
-    # Step A: Agentic Query Generation
-    query_prompt = f"Identify the specific Karnataka land laws relevant to these errors: {failures}. Provide 2 precise research queries."
-    queries = model.generate_content(query_prompt).text.split('\n')
+    # Step A: Queries come straight from the failures (no extra Gemini round-trip)
+    queries = [f"{fail['check_name']} {fail['reason']}" for fail in failures]
 
-    # Step B: Hybrid Retrieval
+    # Step B: Hybrid Retrieval, one batched search for all queries
     retrieved_laws = []
-    for q in queries:
-        if q.strip():
-            # Uses your indexer to find Section numbers like 'Section 17'
-            hits = indexer.search(q, k=2) 
-            retrieved_laws.extend([h.page_content for h in hits])
+    for hits in indexer.search_batch(queries, k=2):
+        # Uses your indexer to find Section numbers like 'Section 17'
+        retrieved_laws.extend(h.get('text', '') for h in hits)
             
-    return "\n\n".join(list(set(retrieved_laws)))
\ No newline at end of file
+    # dict.fromkeys dedupes while keeping retrieval order
+    return "\n\n".join(dict.fromkeys(t for t in retrieved_laws if t))
@@ -14,6 +14,7 @@ Updated Rubric:
 """
 
 import logging
+import numpy as np
 from typing import Dict, List
 
 logger = logging.getLogger(__name__)
@@ -59,23 +60,23 @@ RISK_RULES = [
     }
 ]
 
+# Points added per failed check, by its risk level
+RISK_LEVEL_POINTS = {"critical": 40, "high": 20}
+
 # -----------changed on 20th Feb 2026 by Susanna ------------------
 def calculate_risk_score(validation_results, ec_data):
     """Calculates 0-100 risk based on weighted legal gravity."""
-    score = 0
-    flags = []
+    failed = [check for check in validation_results if not check.get('passed')]
     
-    for check in validation_results:
-        if not check.get('passed'):
-            # Weighted Critical Failures
-            if check['risk_level'] == "critical":
-                score += 40 
-                flags.append(check['check_name'])
-            elif check['risk_level'] == "high":
-                score += 20
+    # Weighted Critical Failures
+    points = np.fromiter(
+        (RISK_LEVEL_POINTS.get(check['risk_level'], 0) for check in failed),
+        dtype=np.int32, count=len(failed)
+    )
+    flags = [check['check_name'] for check in failed if check['risk_level'] == "critical"]
     
     # Cap and Scale
-    final_score = min(100, score)
+    final_score = int(min(100, points.sum()))
     
     if final_score >= 80: rating = "CRITICAL - DO NOT BUY"
     elif final_score >= 40: rating = "HIGH RISK - PROCEED WITH CAUTION"
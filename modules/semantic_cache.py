@@ -0,0 +1,96 @@
+"""
+semantic_cache.py
+─────────────────
+Similarity-keyed cache for LLM outputs.
+
+Entries are keyed by the L2-normalised embedding of the prompt input, so a
+near-identical input (cosine >= threshold) reuses the stored output instead of
+paying another Gemini round-trip. An optional `scope` (e.g. the property a
+verdict belongs to) must match exactly, so similar inputs from unrelated
+records never share an output. Entries expire after `ttl` seconds and the
+least recently used one is evicted once `max_size` is reached.
+"""
+
+import time
+import bisect
+import logging
+import threading
+import numpy as np
+from typing import Any, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """FAISS inner-product index over cached keys, with TTL + LRU eviction."""
+
+    def __init__(self, threshold: float = 0.9, max_size: int = 1000, ttl: float = 24 * 3600):
+        self.threshold = threshold
+        self.max_size  = max_size
+        self.ttl       = ttl
+        self._keys:    List[np.ndarray] = []
+        self._values:  List[Any]        = []
+        self._created: List[float]      = []   # insertion order, so always sorted
+        self._used:    List[float]      = []
+        self._scopes:  List[Hashable]   = []
+        self._index    = None
+        self._lock     = threading.Lock()
+
+    def get(self, embedding: np.ndarray, scope: Hashable = None) -> Optional[Any]:
+        q = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        with self._lock:
+            self._expire()
+            ids = np.array([i for i, s in enumerate(self._scopes) if s == scope], dtype=np.int64)
+            if not len(ids):
+                return None
+            import faiss
+            # Only entries from the same scope are candidates
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(ids))
+            scores, idxs = self._index.search(q, 1, params=params)
+            i = int(idxs[0][0])
+            if i == -1 or scores[0][0] < self.threshold:
+                return None
+            self._used[i] = time.monotonic()
+            logger.info("Semantic cache hit (cosine %.3f)", scores[0][0])
+            return self._values[i]
+
+    def put(self, embedding: np.ndarray, value: Any, scope: Hashable = None):
+        k = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        with self._lock:
+            self._expire()
+            if len(self._keys) >= self.max_size:
+                self._drop([int(np.argmin(self._used))])
+            if self._index is None:
+                self._rebuild(k.shape[1])
+            now = time.monotonic()
+            self._keys.append(k[0])
+            self._values.append(value)
+            self._created.append(now)
+            self._used.append(now)
+            self._scopes.append(scope)
+            self._index.add(k)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _expire(self):
+        stale = bisect.bisect_left(self._created, time.monotonic() - self.ttl)
+        if stale:
+            self._drop(range(stale))
+
+    def _drop(self, positions):
+        """Removes entries and rebuilds the index (rare: eviction or expiry only)."""
+        gone = set(positions)
+        keep = [i for i in range(len(self._keys)) if i not in gone]
+        self._keys    = [self._keys[i] for i in keep]
+        self._values  = [self._values[i] for i in keep]
+        self._created = [self._created[i] for i in keep]
+        self._used    = [self._used[i] for i in keep]
+        self._scopes  = [self._scopes[i] for i in keep]
+        self._rebuild(self._index.d)
+
+    def _rebuild(self, dimension: int):
+        import faiss
+        self._index = faiss.IndexFlatIP(dimension)
+        if self._keys:
+            self._index.add(np.vstack(self._keys))
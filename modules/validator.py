@@ -29,17 +29,53 @@ validator.py
 Strict Cross-Document Integrity Engine for Karnataka Land Records.
 """
 
+import sys
 import json
 import logging
-import google.generativeai as genai
+import functools
+import unicodedata
+import jellyfish
+import fastjsonschema
+import numpy as np
+from rapidfuzz import fuzz, process
+from rapidfuzz.distance import Indel
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from modules.semantic_cache import SemanticCache
+from modules.llm_cache import cached_generate
+from modules.rag_engine import _model
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # stdlib json also accepts bytes
+    _json_loads = json.loads
 
 logger = logging.getLogger(__name__)
 
 # --- 1. CONFIGURATION ---
 USER_UPLOADS_DIR = Path(__file__).parent.parent / "user_uploads"
 
+# Gemini verdicts for similar transaction histories (cosine >= 0.9) of the same
+# property: scoped by (survey number, owner) so one dossier's verdict is never
+# shown for another
+_RAG_CACHE = SemanticCache(threshold=0.9, max_size=1000)
+
+# path -> (st_mtime_ns, parsed JSON); unchanged files skip the re-parse
+_JSON_CACHE: Dict[Path, Tuple[int, dict]] = {}
+
+def _load_cached(path: Path, doc_type: str) -> dict:
+    """Loads a JSON file in canonical shape, reusing the last parse while its mtime is unchanged."""
+    mtime = path.stat().st_mtime_ns
+    hit = _JSON_CACHE.get(path)
+    if hit and hit[0] == mtime:
+        return hit[1]
+    # Raw bytes straight to the parser: no text-mode decode pass
+    data = _canonical(doc_type, _json_loads(path.read_bytes()))
+    _JSON_CACHE[path] = (mtime, data)
+    return data
+
 # --- 2. HELPER: STANDARDIZED RESULTS ---
 def make_result(check_name, passed, reason, risk_level="low"):
     return {
@@ -50,27 +86,147 @@ def make_result(check_name, passed, reason, risk_level="low"):
         "status": "PASS" if passed else "FAIL"
     }
 
-# --- 3. HARD DATA CHECKS (Local Logic) ---
+# Owner names count as the same person when every (sorted) token reaches this
+# Indel similarity (0-1) and the phonetic keys agree ...
+NAME_SIMILARITY_THRESHOLD = 0.85
+# ... or, for the remaining typo / partial-name cases, this token_set_ratio (0-100)
+NAME_MATCH_THRESHOLD = 85
+
+# --- 3. FIELD EXTRACTORS ---
+# Candidate locations per field, tried in order; the first non-empty value wins
+_EC_OWNER_PATHS     = (("transactions", -1, "claimant"),)
+_KHATA_OWNER_PATHS  = (("owner_name",), ("ownership_details", "owner_name"), ("entries", 0, "owner_name"))
+_SD_PURCHASER_PATHS = (("purchaser_name",), ("purchaser", "name"))
+_EC_SURVEY_PATHS    = (("survey_number",),)
+_KHATA_SURVEY_PATHS = (("survey_number",), ("land_details", "survey_number"), ("property_details", "survey_number"))
+
+def _dig(d, path):
+    """Walks dict keys / list indices without allocating fallback containers."""
+    cur = d
+    for k in path:
+        if isinstance(cur, dict):
+            cur = cur.get(k)
+        elif isinstance(cur, list) and isinstance(k, int) and -len(cur) <= k < len(cur):
+            cur = cur[k]
+        else:
+            return None
+        if cur is None:
+            return None
+    return cur
+
+@functools.lru_cache(maxsize=1024)
+def _norm(name: str) -> str:
+    """
+    NFKC + casefold, punctuation -> space, whitespace collapsed; memoised.
+    Letters, marks and digits are kept: Kannada vowel signs and viramas are marks,
+    and dropping them (as rapidfuzz's default_process does) merges distinct names.
+    """
+    name = unicodedata.normalize("NFKC", name).casefold()
+    return " ".join("".join(c if unicodedata.category(c)[0] in "LMN" else " " for c in name).split())
+
+@functools.lru_cache(maxsize=1024)
+def _metaphone(name: str) -> str:
+    # Per token, sorted: word order ('kumar anil') doesn't change the key.
+    # Metaphone only models English spelling, so non-ASCII tokens are left out
+    return " ".join(sorted(jellyfish.metaphone(t) for t in name.split() if t.isascii()))
+
+def _fuzzy_name_match(a: str, b: str) -> bool:
+    """
+    Typo-tolerant name comparison ('anil kumaar' vs 'anil kumar').
+    Different phonetic keys are rejected without scoring, so near-miss names of
+    different people ('mohan rao' vs 'rohan rao') never reach token_set_ratio.
+    """
+    if not a or not b:
+        return False
+    ta, tb = set(a.split()), set(b.split())
+    # A lone token ('kumar', 'rao') can't identify an owner against a fuller name,
+    # and token_set_ratio would score that subset 100
+    if len(ta) != len(tb) and min(len(ta), len(tb)) < 2:
+        return False
+    if ta <= tb or tb <= ta:  # partial names on whole tokens: 'anil kumar' vs 'anil kumar reddy'
+        return True
+    if _metaphone(a) != _metaphone(b):
+        return False
+    # Non-ASCII tokens have no phonetic key, so here they must match exactly;
+    # their typo tolerance comes from the per-token Indel pass
+    if any(not t.isascii() for t in set(a.split()) ^ set(b.split())):
+        return False
+    return fuzz.token_set_ratio(a, b, processor=None) >= NAME_MATCH_THRESHOLD
+
+def _as_str(value) -> str:
+    """Strips strings in place of str(x).strip(); only non-strings are converted."""
+    if isinstance(value, str):
+        return value.strip()
+    return str(value) if value is not None else ""
+
+def _first(d, paths):
+    for path in paths:
+        value = _dig(d, path)
+        if value:
+            return value
+    return ""
+
+# --- 3b. CANONICAL SHAPE ---
+# Each document is flattened once on load: the fields the checks read are lifted
+# to fixed top-level keys, then a precompiled validator fills defaults and
+# rejects wrong types, so the checks below index directly.
+_STR = {"type": "string", "default": ""}
+
+EC_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "owner_name": _STR,
+        "survey_number": _STR,
+        # Items are left unchecked: the structural checks never read them
+        "transactions": {"type": "array", "default": []},
+    },
+}
+KHATA_SCHEMA = {
+    "type": "object",
+    "properties": {"owner_name": _STR, "survey_number": _STR},
+}
+SALE_DEED_SCHEMA = {
+    "type": "object",
+    "properties": {"purchaser_name": _STR},
+}
+
+# doc_type -> (compiled validator, canonical key -> candidate paths)
+_CANONICAL = {
+    "ec": (fastjsonschema.compile(EC_SCHEMA),
+           {"owner_name": _EC_OWNER_PATHS, "survey_number": _EC_SURVEY_PATHS}),
+    "khata": (fastjsonschema.compile(KHATA_SCHEMA),
+              {"owner_name": _KHATA_OWNER_PATHS, "survey_number": _KHATA_SURVEY_PATHS}),
+    "sale_deed": (fastjsonschema.compile(SALE_DEED_SCHEMA),
+                  {"purchaser_name": _SD_PURCHASER_PATHS}),
+}
+
+def _canonical(doc_type: str, data) -> Dict:
+    """
+    Returns `data` in canonical flat shape. Idempotent; raises
+    fastjsonschema.JsonSchemaException if the document has the wrong shape.
+    """
+    if not isinstance(data, dict):
+        raise fastjsonschema.JsonSchemaException(f"{doc_type} must be a JSON object")
+    validate, fields = _CANONICAL[doc_type]
+    # null means absent, so the schema defaults apply
+    doc = {k: v for k, v in data.items() if v is not None}
+    for key, paths in fields.items():
+        doc[key] = _as_str(_first(data, paths))
+    return validate(doc)
+
+# --- 4. HARD DATA CHECKS (Local Logic) ---
 
 def check_cross_document_ownership(ec: Dict, khata: Dict, sd: Dict) -> Dict:
     """Strictly verifies if the owner is the same across all three docs."""
-    
-    # EC: Get claimant from the most recent transaction
-    txns = ec.get("transactions", [])
-    ec_owner = (txns[-1].get("claimant") if txns else "").strip().lower()
-    
-    # Khata: Check multiple common keys
-    khata_owner = (
-        khata.get("owner_name") or 
-        khata.get("ownership_details", {}).get("owner_name") or 
-        khata.get("entries", [{}])[0].get("owner_name", "")
-    ).strip().lower()
-    
-    # Sale Deed: Direct key
-    sd_purchaser = (sd.get("purchaser_name") or sd.get("purchaser", {}).get("name", "")).strip().lower()
+    ec, khata, sd = _canonical("ec", ec), _canonical("khata", khata), _canonical("sale_deed", sd)
+
+    # EC: claimant of the most recent transaction, lifted on canonicalisation
+    ec_owner = _norm(ec["owner_name"])
+    khata_owner = _norm(khata["owner_name"])
+    sd_purchaser = _norm(sd["purchaser_name"])
 
-    # DEBUGGING: This will show up in your terminal
-    print(f"DEBUG | EC: '{ec_owner}' | Khata: '{khata_owner}' | Deed: '{sd_purchaser}'")
+    # DEBUGGING: lazy %-formatting, nothing is built unless DEBUG logging is on
+    logger.debug("EC: '%s' | Khata: '%s' | Deed: '%s'", ec_owner, khata_owner, sd_purchaser)
 
     if not ec_owner or not khata_owner or not sd_purchaser:
         return make_result(
@@ -91,52 +247,128 @@ def check_cross_document_ownership(ec: Dict, khata: Dict, sd: Dict) -> Dict:
 
 def check_survey_consistency(ec: Dict, khata: Dict, sd: Dict) -> Dict:
     """Verifies the Survey Number is identical across documents."""
-    ec_s = str(ec.get("survey_number") or "").strip()
-    khata_s = str(
-        khata.get("survey_number") or 
-        khata.get("land_details", {}).get("survey_number", "") or
-        khata.get("property_details", {}).get("survey_number", "")
-    ).strip()
+    ec, khata = _canonical("ec", ec), _canonical("khata", khata)
+    # Interned: survey tokens repeat across documents, so equality is a pointer check
+    ec_s = sys.intern(ec["survey_number"])
+    khata_s = sys.intern(khata["survey_number"])
     
     if not ec_s or not khata_s:
         return make_result("Survey Consistency", False, "Missing survey number in one or more files.", "medium")
 
-    passed = ec_s == khata_s
+    passed = ec_s is khata_s
     return make_result(
         "Survey Number Consistency", passed,
         "Survey numbers match." if passed else f"Mismatch: EC lists {ec_s}, Khata lists {khata_s}.",
         "critical" if not passed else "low"
     )
 
-# --- 4. AGENTIC RAG CHECKS ---
+# --- 5. AGENTIC RAG CHECKS ---
+
+# Common Karnataka transaction types -> retrieval query. Warmed with one batched
+# search the first time an index is used, so typical dossiers skip the ANN lookup.
+_WARM_PATTERNS = {
+    "sale":      "sale deed registration Karnataka",
+    "gift":      "gift deed transfer of immovable property",
+    "partition": "partition deed among family members",
+    "mortgage":  "mortgage and release of mortgage",
+}
+_WARM: Dict[str, List[Dict]] = {}
+_WARM_KEY = None
+
+def _warm_hits(indexer) -> Dict[str, List[Dict]]:
+    """Returns pattern -> hits, recomputed only when the index changes."""
+    global _WARM, _WARM_KEY
+    key = (id(indexer), indexer.vector_count)
+    if _WARM_KEY != key:
+        patterns = list(_WARM_PATTERNS)
+        hits = indexer.search_batch([_WARM_PATTERNS[p] for p in patterns], k=2)
+        _WARM, _WARM_KEY = dict(zip(patterns, hits)), key
+    return _WARM
+
+def _classify_transactions(txns: List) -> List[str]:
+    """Keyword-matches transaction natures against the warmed patterns."""
+    natures = " ".join(str(t.get("nature") or "") for t in txns if isinstance(t, dict)).lower()
+    return [p for p in _WARM_PATTERNS if p in natures]
+
+_VERDICT_PREFIX = "VERDICT:"
+
+def _is_compliant(verdict: str) -> bool:
+    """Exact match on the closing verdict line; prose like 'non-compliant' never passes."""
+    lines = verdict.strip().splitlines()
+    return bool(lines) and lines[-1].strip().strip("*").strip() == f"{_VERDICT_PREFIX} COMPLIANT"
 
 def run_rag_checks(ec_data: Dict, indexer) -> List[Dict]:
-    """Generates legal queries based on transaction history."""
+    """Retrieves statutes for the recent transaction history and checks compliance."""
+    return run_rag_checks_batch([ec_data], indexer)[0]
+
+def run_rag_checks_batch(ec_list: List[Dict], indexer) -> List[List[Dict]]:
+    """
+    run_rag_checks for many dossiers: all queries are embedded in one forward pass
+    and every retrieval that isn't cached or warmed shares one FAISS search.
+    """
     if not indexer or indexer.vector_count == 0:
-        return []
+        return [[] for _ in ec_list]
 
-    results = []
-    model = genai.GenerativeModel('gemini-2.5-flash')
+    model = _model()
     
+    ec_list = [_canonical("ec", ec) for ec in ec_list]
     # Analyze the last 3 transactions for legal red flags
-    txns = ec_data.get("transactions", [])[-3:]
-    query_gen = f"Analyze these Karnataka land transactions: {txns}. Identify 1 specific legal section to verify."
+    histories = [ec["transactions"][-3:] for ec in ec_list]
+    # No survey number: nothing identifies the property, so the cache is skipped
+    scopes = [(ec["survey_number"], _norm(ec["owner_name"])) if ec["survey_number"] else None
+              for ec in ec_list]
+    # Deterministic retrieval query: no LLM round-trip just to name the statute
+    queries = [f"legal sections relevant to transactions: {txns}" for txns in histories]
     
     try:
-        search_query = model.generate_content(query_gen).text
-        # Perform Hybrid Search in your 276 vectors
-        hits = indexer.search(search_query, k=2)
-        context = "\n\n".join([h.page_content for h in hits])
-        
-        verify = model.generate_content(f"Context: {context}\nIs this transaction history compliant with Karnataka law?").text
-        
-        results.append(make_result("Statutory Compliance (RAG)", "compliant" in verify.lower(), verify[:200] + "...", "medium"))
+        keys = indexer.embedder.embed(queries)
+        # Near-identical transaction histories reuse the earlier verdict
+        verdicts = [_RAG_CACHE.get(key, scope) if scope else None
+                    for key, scope in zip(keys, scopes)]
+
+        contexts, pending = {}, []
+        for i, txns in enumerate(histories):
+            if verdicts[i] is not None:
+                continue
+            patterns = _classify_transactions(txns)
+            if patterns:
+                # Known transaction types: reuse the warmed retrieval results
+                warm = _warm_hits(indexer)
+                contexts[i] = [h for p in patterns for h in warm[p]]
+            else:
+                pending.append(i)
+        # Perform Hybrid Search in your 276 vectors, one call for the rest
+        for i, hits in zip(pending, indexer.search_by_vectors(keys[pending], k=2)):
+            contexts[i] = hits
     except Exception as e:
         logger.error(f"RAG Check Error: {e}")
+        return [[] for _ in ec_list]
+
+    results = []
+    for i, txns in enumerate(histories):
+        verify = verdicts[i]
+        try:
+            if verify is None:
+                context = "\n\n".join(dict.fromkeys(h.get("text", "") for h in contexts[i]))
+                # ONE call: pick the governing section from the context and judge compliance
+                verify = cached_generate(
+                    model,
+                    f"Context: {context}\n"
+                    f"Transactions: {txns}\n"
+                    "Identify the specific legal section in the context that governs these Karnataka "
+                    "land transactions, then state whether this transaction history is compliant with Karnataka law. "
+                    f"End with a final line that is exactly '{_VERDICT_PREFIX} COMPLIANT' or '{_VERDICT_PREFIX} NON_COMPLIANT'."
+                )
+                if scopes[i]:
+                    _RAG_CACHE.put(keys[i], verify, scopes[i])
+            results.append([make_result("Statutory Compliance (RAG)", _is_compliant(verify), verify[:200] + "...", "medium")])
+        except Exception as e:
+            logger.error(f"RAG Check Error: {e}")
+            results.append([])
         
     return results
 
-# --- 5. MASTER RUNNER ---
+# --- 6. MASTER RUNNER ---
 
 # def run_all_validations(indexer) -> List[Dict]:
 #     """Orchestrates all checks using stored JSON files."""
@@ -154,6 +386,9 @@ def run_rag_checks(ec_data: Dict, indexer) -> List[Dict]:
 #     ]
 
 #     # 2. RAG Checks (Only if structural checks aren't a total failure)
+#     # A critical structural failure already rejects the dossier: skip the LLM calls
+#     if any(c["risk_level"] == "critical" and not c["passed"] for c in checks):
+#         return checks
 #     checks.extend(run_rag_checks(ec, indexer))
     
 #     return checks
@@ -162,39 +397,102 @@ def run_all_validations(indexer):
     """Orchestrates structural 'Hard Checks' using stored JSONs."""
     try:
         # Standardized local loading
-        with open("user_uploads/user_ec.json", "r") as f: ec = json.load(f)
-        with open("user_uploads/user_khata.json", "r") as f: khata = json.load(f)
-        with open("user_uploads/user_sale_deed.json", "r") as f: sd = json.load(f)
+        # Three independent reads: overlap them (file I/O releases the GIL)
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            ec, khata, sd = executor.map(_load_cached, [
+                USER_UPLOADS_DIR / "user_ec.json",
+                USER_UPLOADS_DIR / "user_khata.json",
+                USER_UPLOADS_DIR / "user_sale_deed.json",
+            ], ["ec", "khata", "sale_deed"])
     except Exception as e:
-        return {"error": str(e), "rule_checks": []}
+        # Includes schema rejections. Fail closed: a dossier that can't be read
+        # must not come out as a clean PASS, so report a critical failing check
+        return {
+            "error": str(e),
+            "rule_checks": [make_result("Document Data Integrity", False, f"Could not load extracted data: {e}", "critical")],
+            "total_passed": 0,
+            "status": "FAIL"
+        }
 
-    results = []
-    
-    # Check 1: Title Continuity
-    sd_p = (sd.get("purchaser_name") or sd.get("purchaser", {}).get("name", "")).lower().strip()
-    k_o = (khata.get("owner_name") or khata.get("entries", [{}])[0].get("owner_name", "")).lower().strip()
-    title_match = sd_p in k_o or k_o in sd_p
-    results.append({
-        "check_name": "Cross-Document Title Match",
-        "passed": title_match,
-        "risk_level": "critical",
-        "reason": "Ownership verified." if title_match else f"Mismatch: Deed({sd_p}) vs Khata({k_o})"
-    })
-
-    # Check 2: Survey Consistency
-    ec_s = str(ec.get("survey_number") or "").strip()
-    khata_s = str(khata.get("survey_number") or khata.get("land_details", {}).get("survey_number", "")).strip()
-    survey_match = ec_s == khata_s if ec_s and khata_s else False
-    results.append({
-        "check_name": "Survey Number Consistency",
-        "passed": survey_match,
-        "risk_level": "critical",
-        "reason": "Survey numbers match." if survey_match else f"Mismatch: EC({ec_s}) vs Khata({khata_s})"
-    })
-
-    # Return as DICTIONARY to satisfy downstream .get() calls
-    return {
-        "rule_checks": results,
-        "total_passed": sum(1 for r in results if r["passed"]),
-        "status": "FAIL" if any(not r["passed"] for r in results) else "PASS"
-    }
\ No newline at end of file
+    # Already canonical: skip the re-validation in run_batch_validations
+    return _structural_checks([(ec, khata, sd)])[0]
+
+def run_batch_validations(dossiers: List[Tuple[Dict, Dict, Dict]]) -> List[Dict]:
+    """
+    Runs the structural 'Hard Checks' over many (ec, khata, sale_deed) dossiers
+    in one vectorised pass; returns one run_all_validations-style dict per dossier.
+    """
+    return _structural_checks([
+        (_canonical("ec", ec), _canonical("khata", khata), _canonical("sale_deed", sd))
+        for ec, khata, sd in dossiers
+    ])
+
+def _structural_checks(dossiers: List[Tuple[Dict, Dict, Dict]]) -> List[Dict]:
+    """run_batch_validations body for dossiers already in canonical shape."""
+    if not dossiers:
+        return []
+
+    sd_p = [_norm(sd["purchaser_name"]) for _, _, sd in dossiers]
+    k_o = [_norm(khata["owner_name"]) for _, khata, _ in dossiers]
+    ec_s = np.array([ec["survey_number"] for ec, _, _ in dossiers], dtype=str)
+    khata_s = np.array([khata["survey_number"] for _, khata, _ in dossiers], dtype=str)
+
+    # Check 1: Title Continuity. Names are scored per token, so one changed letter
+    # in a short given name ('mohan' vs 'rohan') can't hide inside a long full name.
+    # All token pairs of the batch go through one cpdist call (SIMD C++, GIL released)
+    left, right, owner = [], [], []
+    for i, (a, b) in enumerate(zip(sd_p, k_o)):
+        ta, tb = sorted(a.split()), sorted(b.split())
+        if ta and len(ta) == len(tb):
+            left += ta
+            right += tb
+            owner += [i] * len(ta)
+    # Weakest token similarity per dossier; 0 where the token counts differ
+    weakest = np.zeros(len(dossiers))
+    if left:
+        token_sim = process.cpdist(left, right, scorer=Indel.normalized_similarity,
+                                   processor=None, workers=-1)
+        scored = np.unique(owner)
+        weakest[scored] = np.inf
+        np.minimum.at(weakest, owner, token_sim)
+    title_match = np.array([
+        weakest[i] >= NAME_SIMILARITY_THRESHOLD and _metaphone(sd_p[i]) == _metaphone(k_o[i])
+        for i in range(len(dossiers))
+    ], dtype=bool)
+    # Then partial/fuzzy matching for the rest
+    for i in np.flatnonzero(~title_match):
+        title_match[i] = _fuzzy_name_match(sd_p[i], k_o[i])
+    # A missing name never verifies ownership ('' vs '' scores 1.0)
+    title_known = np.array([bool(a) and bool(b) for a, b in zip(sd_p, k_o)], dtype=bool)
+    title_match &= title_known
+
+    # Check 2: Survey Consistency (both present and identical)
+    survey_match = (ec_s == khata_s) & (ec_s != "") & (khata_s != "")
+
+    outputs = []
+    for i in range(len(dossiers)):
+        title_ok, survey_ok = bool(title_match[i]), bool(survey_match[i])
+        results = [
+            {
+                "check_name": "Cross-Document Title Match",
+                "passed": title_ok,
+                "risk_level": "critical",
+                "reason": ("Ownership verified." if title_ok
+                           else f"Mismatch: Deed({sd_p[i]}) vs Khata({k_o[i]})" if title_known[i]
+                           else "Data Extraction Incomplete: Deed purchaser or Khata owner could not be identified.")
+            },
+            {
+                "check_name": "Survey Number Consistency",
+                "passed": survey_ok,
+                "risk_level": "critical",
+                "reason": "Survey numbers match." if survey_ok else f"Mismatch: EC({ec_s[i]}) vs Khata({khata_s[i]})"
+            },
+        ]
+
+        # Return as DICTIONARY to satisfy downstream .get() calls
+        outputs.append({
+            "rule_checks": results,
+            "total_passed": int(title_ok) + int(survey_ok),
+            "status": "PASS" if title_ok and survey_ok else "FAIL"
+        })
+    return outputs
@@ -0,0 +1,94 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import modules.validator as validator
+from modules.validator import _fuzzy_name_match, _is_compliant, _norm, run_all_validations, run_batch_validations
+
+
+@pytest.mark.parametrize("a, b", [
+    ("mohan rao", "rohan rao"),
+    ("ramesh", "rajesh"),
+    ("ramesh kumar", "rajesh kumar"),
+    ("Ram", "Sriram"),
+    ("Rao", "Mohan Rao"),
+    ("Kumar", "Anil Kumar"),
+    ("Anil", "Anil Kumar"),
+])
+def test_fuzzy_name_match_rejects_near_miss_names(a, b):
+    assert not _fuzzy_name_match(_norm(a), _norm(b))
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Anil Kumaar", "anil kumar"),
+    ("Suresh Babu", "suresh baabu"),
+    ("Kumar Anil", "Anil Kumar"),
+    ("Anil Kumar", "Anil Kumar Reddy"),
+])
+def test_fuzzy_name_match_accepts_typos_and_partial_names(a, b):
+    assert _fuzzy_name_match(_norm(a), _norm(b))
+
+
+def test_fuzzy_name_match_rejects_missing_names():
+    assert not _fuzzy_name_match("", "anil kumar")
+    assert not _fuzzy_name_match("", "")
+
+
+@pytest.mark.parametrize("verdict, expected", [
+    ("Section 5 applies.\nVERDICT: COMPLIANT", True),
+    ("The history is non-compliant with Section 5.\nVERDICT: NON_COMPLIANT", False),
+    ("This transaction history is not compliant.", False),
+    ("", False),
+])
+def test_is_compliant_reads_only_the_verdict_line(verdict, expected):
+    assert _is_compliant(verdict) is expected
+
+
+def _title_check(purchaser, owner):
+    dossier = ({"survey_number": "12"},
+               {"owner_name": owner, "survey_number": "12"},
+               {"purchaser_name": purchaser})
+    return run_batch_validations([dossier])[0]["rule_checks"][0]
+
+
+@pytest.mark.parametrize("purchaser, owner, expected", [
+    ("Mohan Rao", "rohan rao", False),
+    ("Ramesh Kumar", "rajesh kumar", False),
+    ("Anil Kumaar", "anil kumar", True),
+    ("Kumar Anil", "anil kumar", True),
+    ("ರಾಮು ಗೌಡ", "ರೀಮಾ ಗೌಡ", False),
+    ("ರಾಮು ಗೌಡ", "ರಾಮಾ ಗೌಡ", False),
+    ("ರಾಮು ಗೌಡ", "ಗೌಡ  ರಾಮು", True),
+])
+def test_batch_title_match_scores_each_name_token(purchaser, owner, expected):
+    assert _title_check(purchaser, owner)["passed"] is expected
+
+
+@pytest.mark.parametrize("purchaser, owner", [("", ""), ("Anil Kumar", ""), ("", "anil kumar")])
+def test_batch_title_match_fails_on_missing_names(purchaser, owner):
+    check = _title_check(purchaser, owner)
+    assert not check["passed"]
+    assert check["reason"].startswith("Data Extraction Incomplete")
+
+
+def test_norm_keeps_kannada_vowel_signs():
+    assert _norm("ರಾಮು ಗೌಡ") == "ರಾಮು ಗೌಡ"
+    assert _norm("ರಾಮು ಗೌಡ") != _norm("ರೀಮಾ ಗೌಡ")
+    assert _norm("  Anil  K. Kumar,") == "anil k kumar"
+
+
+def test_run_all_validations_fails_closed_on_malformed_data(tmp_path, monkeypatch):
+    (tmp_path / "user_ec.json").write_text(json.dumps(["not", "an", "object"]))
+    (tmp_path / "user_khata.json").write_text(json.dumps({"owner_name": "Anil Kumar", "survey_number": "12"}))
+    (tmp_path / "user_sale_deed.json").write_text(json.dumps({"purchaser_name": "Anil Kumar"}))
+    monkeypatch.setattr(validator, "USER_UPLOADS_DIR", tmp_path)
+
+    output = run_all_validations(None)
+
+    assert output["status"] == "FAIL"
+    assert output["error"]
+    assert [c["risk_level"] for c in output["rule_checks"] if not c["passed"]] == ["critical"]